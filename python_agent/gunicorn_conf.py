@@ -0,0 +1,45 @@
+import multiprocessing
+
+# Gunicorn configuration for the Bruce agent service.
+# Run with: gunicorn -c gunicorn_conf.py main:app
+bind = "0.0.0.0:5001"
+
+# /bruce spends most of its time waiting on Groq and the GIL is released
+# while it does, so each worker runs many threads. main.py caps in-flight
+# Groq calls per worker with MAX_CONCURRENT_LLM_CALLS and streamed calls
+# with MAX_CONCURRENT_STREAMS (default 8 each, below threads); service-wide
+# that allows workers times each cap.
+workers = multiprocessing.cpu_count() * 2 + 1
+worker_class = "gthread"
+threads = 32
+
+# Load main.py once in the master and fork the workers from it, so that
+# setup (including the .env load and GROQ_API_KEY check) is shared instead
+# of repeated per worker.
+preload_app = True
+
+# LLM responses can take a while to generate.
+timeout = 120
+
+
+def when_ready(server):
+    # main.py builds its LLM lazily; build the default one in the master so
+    # the preloaded workers inherit it on fork instead of each building it
+    import main
+    main.get_llm(main.GROQ_TEMPERATURE)
+
+
+def pre_fork(server, worker):
+    # Drain the master's log queue before forking; records still queued at
+    # fork time would otherwise be copied into the worker and printed again
+    # by its listener
+    import main
+    main.stop_log_listener()
+    main.start_log_listener()
+
+
+def post_fork(server, worker):
+    # The log listener thread started in the master is not carried over by
+    # fork; start a fresh one in each worker
+    import main
+    main.start_log_listener()
@@ -1,86 +1,306 @@
 import os
 import sys
-from flask import Flask, request, jsonify
+import queue
+import atexit
+import hashlib
+import logging
+import functools
+import threading
+from logging.handlers import QueueHandler, QueueListener
+import orjson
+from cachetools import LRUCache
+from flask import Flask, Response, request
 from dotenv import load_dotenv
 from crewai import Agent, Task, Crew, LLM
+from groq import Groq
 
-# Load environment variables from .env file and verify API key
+# Log through a queue so request threads only enqueue records and a
+# background listener thread does the actual stderr writes
+log_queue = queue.SimpleQueue()
+logger = logging.getLogger('bruce')
+logger.setLevel(logging.INFO)
+logger.addHandler(QueueHandler(log_queue))
+logger.propagate = False
+log_listener = None
+
+def start_log_listener():
+    """Start the background thread that writes queued log records.
+
+    Threads do not survive fork, so gunicorn calls this again in each worker.
+    """
+    global log_listener
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(
+        '%(asctime)s [%(process)d] %(levelname)s %(name)s: %(message)s'
+    ))
+    log_listener = QueueListener(log_queue, handler)
+    log_listener.start()
+
+def stop_log_listener():
+    """Flush queued records and stop the listener thread."""
+    global log_listener
+    if log_listener is not None:
+        log_listener.stop()
+        log_listener = None
+
+start_log_listener()
+atexit.register(stop_log_listener)
+
+# Load environment variables from .env file and verify API key. Under
+# gunicorn with preload_app this runs once in the master and the forked
+# workers inherit the result.
 load_dotenv()
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
 if not GROQ_API_KEY:
-    print("ERROR: GROQ_API_KEY not found in environment variables!")
-    print("Please make sure your .env file contains GROQ_API_KEY")
+    logger.error("GROQ_API_KEY not found in environment variables!")
+    logger.error("Please make sure your .env file contains GROQ_API_KEY")
     sys.exit(1)
 
 # Initialize Flask app
 app = Flask(__name__)
 
-# Initialize Groq LLM using CrewAI
-try:
-    print(f"Initializing Groq LLM with key: {GROQ_API_KEY[:5]}...")
-    llm = LLM(
-        model="deepseek-r1-distill-llama-70b",
-        temperature=0.6,
-        max_tokens=4096,
-        top_p=0.95,
+def ojsonify(**kwargs):
+    """jsonify replacement that serializes with orjson."""
+    return app.response_class(orjson.dumps(kwargs), mimetype='application/json')
+
+# Cap the number of Groq calls in flight per worker process. The default
+# is well below the gunicorn thread count so extra requests queue here
+# instead of all hitting Groq at once. The cap is per process: the total
+# across the service is workers * MAX_CONCURRENT_LLM_CALLS, so size it
+# against the Groq rate limit with the worker count in mind.
+MAX_CONCURRENT_LLM_CALLS = int(os.getenv("MAX_CONCURRENT_LLM_CALLS", "8"))
+llm_call_slots = threading.BoundedSemaphore(MAX_CONCURRENT_LLM_CALLS)
+
+# Streamed responses hold their slot for as long as the client takes to
+# read the stream, so they get their own per-process limit; slow SSE
+# readers then cannot block the non-streaming /bruce calls
+MAX_CONCURRENT_STREAMS = int(os.getenv("MAX_CONCURRENT_STREAMS", "8"))
+stream_slots = threading.BoundedSemaphore(MAX_CONCURRENT_STREAMS)
+
+# Groq model settings, shared by the CrewAI LLM and the streaming client
+GROQ_MODEL = "deepseek-r1-distill-llama-70b"
+GROQ_TEMPERATURE = 0.6
+GROQ_MAX_TOKENS = 4096
+GROQ_TOP_P = 0.95
+
+def create_llm(temperature):
+    """Create the CrewAI Groq LLM with the shared model settings."""
+    return LLM(
+        model=GROQ_MODEL,
+        temperature=temperature,
+        max_tokens=GROQ_MAX_TOKENS,
+        top_p=GROQ_TOP_P,
         stream=False,
         stop=None
     )
-    print("Groq LLM initialized successfully!")
-except Exception as e:
-    print(f"CRITICAL ERROR initializing Groq LLM: {str(e)}")
-    print("Detailed exception info:", repr(e))
-    sys.exit(1)  # Exit the application if LLM can't be initialized
-
-# Define the CrewAI agents for healthcare management
-healthcare_agent = Agent(
-    role='Healthcare Management Assistant',
-    goal='Provide professional and helpful assistance with healthcare scheduling and client/caregiver management',
-    backstory='''You are Bruce, an experienced healthcare management assistant. You help
+
+# Bruce's persona and task text, shared by the CrewAI agent/task and the
+# streaming prompt so both modes answer the same way
+BRUCE_ROLE = 'Healthcare Management Assistant'
+BRUCE_GOAL = 'Provide professional and helpful assistance with healthcare scheduling and client/caregiver management'
+BRUCE_BACKSTORY = '''You are Bruce, an experienced healthcare management assistant. You help
     manage a care facility's operations, including client information, caregiver profiles,
     scheduling, and answering questions about healthcare policies. You are professional,
     helpful, and compassionate in your responses, focusing on providing clear, actionable
     information while maintaining a warm tone. You always prioritize client care needs when
-    making recommendations about scheduling or caregiver assignments.''',
-    llm=llm,
-    verbose=True
-)
+    making recommendations about scheduling or caregiver assignments.'''
+TASK_DESCRIPTION = "Respond to this healthcare-related query: {prompt}"
+TASK_EXPECTED_OUTPUT = "A professional, helpful, and compassionate response that provides clear information and actionable guidance."
 
-@app.route('/bruce', methods=['POST'])
-def handle_bruce_request():
+def create_healthcare_agent(llm):
+    """Create Bruce, the healthcare management agent, backed by the given LLM."""
+    return Agent(
+        role=BRUCE_ROLE,
+        goal=BRUCE_GOAL,
+        backstory=BRUCE_BACKSTORY,
+        llm=llm,
+        verbose=True
+    )
+
+@functools.lru_cache(maxsize=None)
+def get_llm(temperature):
+    """Return the Groq LLM for a temperature, building it on first use.
+
+    Construction is deferred so importing this module (e.g. in a gunicorn
+    worker that never serves /bruce) stays cheap.
+    """
+    logger.info(f"Initializing Groq LLM (temperature={temperature}) with key: {GROQ_API_KEY[:5]}...")
+    llm = create_llm(temperature)
+    logger.info("Groq LLM initialized successfully!")
+    return llm
+
+# CrewAI mutates an agent while it runs a task (agent.crew,
+# agent_executor), so an agent must not be shared across concurrent
+# kickoffs. A gthread thread serves one request at a time, so each thread
+# keeps its own agents and reuses them across requests.
+thread_agents = threading.local()
+
+def get_healthcare_agent(temperature):
+    """Return this thread's healthcare agent for a temperature, building it
+    on top of the shared LLM on first use."""
+    agents = getattr(thread_agents, 'by_temperature', None)
+    if agents is None:
+        agents = thread_agents.by_temperature = {}
+    agent = agents.get(temperature)
+    if agent is None:
+        agent = agents[temperature] = create_healthcare_agent(get_llm(temperature))
+    return agent
+
+@functools.lru_cache(maxsize=1)
+def get_groq_client():
+    """Return the direct Groq client used for streamed responses; crew.kickoff()
+    only returns once the whole answer has been generated."""
+    return Groq(api_key=GROQ_API_KEY)
+
+# Cache of prompt -> response for repeated queries, keyed by a digest of
+# the prompt and the settings that produced the response
+RESPONSE_CACHE_SIZE = 10_000
+response_cache = LRUCache(maxsize=RESPONSE_CACHE_SIZE)
+response_cache_lock = threading.Lock()
+
+def response_cache_key(prompt, temperature):
+    """Content-addressed cache key for a prompt under the given settings."""
+    return hashlib.blake2b(
+        f"{prompt}|{GROQ_MODEL}|{temperature}".encode(),
+        digest_size=16
+    ).digest()
+
+def sse_event(data, event=None):
+    """Format a Server-Sent Events message. Data is JSON-encoded so tokens
+    containing newlines cannot break the framing."""
+    message = f"data: {orjson.dumps(data).decode()}\n\n"
+    if event:
+        message = f"event: {event}\n{message}"
+    return message
+
+def stream_bruce_response(prompt, temperature):
+    """Stream Bruce's answer token by token as Server-Sent Events."""
+    def generate():
+        response = []
+        with stream_slots:
+            try:
+                messages = [
+                    {
+                        "role": "system",
+                        "content": f"You are {BRUCE_ROLE}. {BRUCE_BACKSTORY}\nYour personal goal is: {BRUCE_GOAL}"
+                    },
+                    {
+                        "role": "user",
+                        "content": (
+                            f"{TASK_DESCRIPTION.format(prompt=prompt)}\n\n"
+                            f"This is the expected criteria for your answer: {TASK_EXPECTED_OUTPUT}"
+                        )
+                    }
+                ]
+                completion = get_groq_client().chat.completions.create(
+                    model=GROQ_MODEL,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=GROQ_MAX_TOKENS,
+                    top_p=GROQ_TOP_P,
+                    # deepseek-r1 otherwise streams its <think> block in
+                    # content; CrewAI only returns the final answer
+                    reasoning_format="hidden",
+                    stream=True
+                )
+                # Close the upstream stream even when the client disconnects
+                # mid-response (GeneratorExit), so the connection is not held
+                # until garbage collection
+                try:
+                    for chunk in completion:
+                        token = chunk.choices[0].delta.content
+                        if token:
+                            response.append(token)
+                            yield sse_event(token)
+                finally:
+                    completion.close()
+                yield sse_event("", event="done")
+            except Exception as e:
+                error_message = str(e)
+                logger.error(f"Error during Groq streaming: {error_message}")
+                yield sse_event(error_message, event="error")
+                return
+        # Log once the stream is finished so it doesn't hold up any tokens
+        logger.info(f"Generated response: {''.join(response)[:100]}...")  # Log first 100 chars
+
+    return Response(generate(), mimetype='text/event-stream')
+
+def answer_prompt(temperature, use_cache):
+    """Run a /bruce style request against an agent at the given temperature.
+
+    When use_cache is set, responses are looked up and stored by prompt so
+    repeated queries skip the Groq call entirely. Cached requests are always
+    answered as JSON; the stream flag only applies to uncached requests.
+    """
     data = request.get_json()
     if not data or 'prompt' not in data:
-        return jsonify({"error": "Prompt not provided"}), 400
+        return ojsonify(error="Prompt not provided"), 400
 
     prompt = data['prompt']
-    print(f"Received prompt: {prompt}")
+    logger.info(f"Received prompt: {prompt}")
+
+    # Clients that send {"stream": true} get tokens as they are generated
+    if data.get('stream') and not use_cache:
+        return stream_bruce_response(prompt, temperature)
+
+    cache_key = None
+    if use_cache:
+        cache_key = response_cache_key(prompt, temperature)
+        with response_cache_lock:
+            cached = response_cache.get(cache_key)
+        if cached is not None:
+            logger.info("Returning cached response")
+            return ojsonify(response=cached)
 
     try:
+        agent = get_healthcare_agent(temperature)
+
         # Create a task for the healthcare agent based on the user's prompt
         task = Task(
-            description=f"Respond to this healthcare-related query: {prompt}",
-            expected_output="A professional, helpful, and compassionate response that provides clear information and actionable guidance.",
-            agent=healthcare_agent
+            description=TASK_DESCRIPTION.format(prompt=prompt),
+            expected_output=TASK_EXPECTED_OUTPUT,
+            agent=agent
         )
 
-        # Create and run the crew with just our healthcare agent
+        # Create and run the crew with just our healthcare agent. The crew
+        # holds this request's task list, so it is built per request while
+        # the agent is reused per thread.
         crew = Crew(
-            agents=[healthcare_agent],
+            agents=[agent],
             tasks=[task],
             verbose=True
         )
 
         # Execute the task and get the result
-        result = crew.kickoff()
-        print(f"Generated response: {result[:100]}...")  # Log first 100 chars
-        
-        return jsonify({"response": result})
+        with llm_call_slots:
+            result = str(crew.kickoff())
+        logger.info(f"Generated response: {result[:100]}...")  # Log first 100 chars
+
+        if cache_key is not None:
+            with response_cache_lock:
+                response_cache[cache_key] = result
+
+        return ojsonify(response=result)
     except Exception as e:
         error_message = str(e)
-        print(f"Error during CrewAI execution: {error_message}")
-        return jsonify({"error": error_message}), 500
+        logger.error(f"Error during CrewAI execution: {error_message}")
+        return ojsonify(error=error_message), 500
+
+@app.route('/bruce', methods=['POST'])
+def handle_bruce_request():
+    # Responses at temperature 0.6 vary between calls, so caching is opt-in;
+    # with ?cache=1 the stream flag is ignored
+    use_cache = request.args.get('cache') == '1'
+    return answer_prompt(GROQ_TEMPERATURE, use_cache)
+
+@app.route('/bruce_det', methods=['POST'])
+def handle_bruce_det_request():
+    # Deterministic (temperature 0) answers are always cached, so this
+    # endpoint ignores the stream flag and always answers as JSON
+    return answer_prompt(0.0, use_cache=True)
 
 if __name__ == '__main__':
-    # Note: This is a development server. For production, use a proper WSGI server.
+    # Development server only. For production run under gunicorn:
+    #   gunicorn -c gunicorn_conf.py main:app
     app.run(host='0.0.0.0', port=5001)
@@ -0,0 +1,106 @@
+import os
+from types import SimpleNamespace
+
+import orjson
+import pytest
+
+os.environ.setdefault("GROQ_API_KEY", "test-key")
+
+import main  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    main.response_cache.clear()
+    return main.app.test_client()
+
+
+@pytest.fixture
+def kickoff_calls(monkeypatch):
+    calls = []
+
+    def fake_kickoff(self, *args, **kwargs):
+        calls.append(self)
+        return "Visit notes are due within 24 hours."
+
+    monkeypatch.setattr(main.Crew, "kickoff", fake_kickoff)
+    return calls
+
+
+class FakeStream:
+    """Stands in for a streamed Groq completion."""
+
+    def __init__(self, tokens, error=None):
+        self.tokens = tokens
+        self.error = error
+        self.closed = False
+
+    def __iter__(self):
+        for token in self.tokens:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))])
+        if self.error:
+            raise self.error
+
+    def close(self):
+        self.closed = True
+
+
+def fake_groq_client(create):
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+def test_bruce_det_serves_repeat_prompt_from_cache(client, kickoff_calls):
+    first = client.post('/bruce_det', json={"prompt": "What are visit-note requirements?"})
+    second = client.post('/bruce_det', json={"prompt": "What are visit-note requirements?"})
+
+    assert first.status_code == second.status_code == 200
+    assert first.get_json() == second.get_json() == {"response": "Visit notes are due within 24 hours."}
+    assert len(kickoff_calls) == 1
+
+
+def test_bruce_without_cache_flag_does_not_cache(client, kickoff_calls):
+    client.post('/bruce', json={"prompt": "What are visit-note requirements?"})
+    client.post('/bruce', json={"prompt": "What are visit-note requirements?"})
+
+    assert len(kickoff_calls) == 2
+    assert len(main.response_cache) == 0
+
+
+def test_missing_prompt_returns_400(client):
+    response = client.post('/bruce', json={"message": "hello"})
+
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Prompt not provided"}
+
+
+def test_stream_sends_json_encoded_tokens_then_done(client, monkeypatch):
+    stream = FakeStream(["Line one\nline two"])
+    requests = []
+
+    def create(**kwargs):
+        requests.append(kwargs)
+        return stream
+
+    monkeypatch.setattr(main, "get_groq_client", lambda: fake_groq_client(create))
+
+    response = client.post('/bruce', json={"prompt": "hi", "stream": True})
+    body = response.get_data(as_text=True)
+
+    assert response.mimetype == 'text/event-stream'
+    assert requests[0]["reasoning_format"] == "hidden"
+    assert main.TASK_EXPECTED_OUTPUT in requests[0]["messages"][1]["content"]
+    events = body.split("\n\n")
+    assert events[0] == "data: " + orjson.dumps("Line one\nline two").decode()
+    assert events[1].startswith("event: done\n")
+    assert stream.closed
+
+
+def test_stream_upstream_error_sends_error_event(client, monkeypatch):
+    stream = FakeStream(["partial"], error=RuntimeError("Groq unavailable"))
+    monkeypatch.setattr(main, "get_groq_client", lambda: fake_groq_client(lambda **kwargs: stream))
+
+    body = client.post('/bruce', json={"prompt": "hi", "stream": True}).get_data(as_text=True)
+
+    assert 'event: error\ndata: "Groq unavailable"' in body
+    assert "event: done" not in body
+    assert stream.closed